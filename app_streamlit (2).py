@@ -14,11 +14,18 @@ Novidades:
 
 import os
 import io
+import sys
+import time
+import uuid
+import hashlib
+import threading
 from datetime import datetime
 
 import streamlit as st
+import numpy as np
 import pandas as pd
 from PIL import Image
+from scipy import sparse
 
 # --- PDF (ReportLab) ---
 from reportlab.lib.pagesizes import A4
@@ -38,6 +45,9 @@ SUGESTOES_DIR = os.path.join(BASE_DIR, "sugestoes")
 CARTA_DIR = os.path.join(BASE_DIR, "CARTA")
 LOGO_PADRAO = os.path.join(CARTA_DIR, "logo_inga.png")
 
+# Sessões ociosas por mais que isso têm os caches descartados (ver varrer_sessoes_ociosas)
+SESSAO_TTL_SEG = 30 * 60
+
 TIPO_ORDEM_FIXA = [
     "Espumantes", "Brancos", "Rosés", "Tintos",
     "Frisantes", "Fortificados", "Vinhos de sobremesa", "Licorosos"
@@ -305,6 +315,367 @@ def exportar_excel_like_pdf(df, inserir_foto=True):
                 row_num += 2; ordem_geral += 1
     stream = io.BytesIO(); wb.save(stream); stream.seek(0); return stream
 
+# ===== Memória da sessão =====
+@st.cache_resource
+def registro_sessoes():
+    """Registro compartilhado entre sessões; sobrevive às re-execuções do script.
+
+    sessoes: sessao_id -> {"ultimo_acesso": ts, "cache": dict cache_sessao da sessão}
+    logos: sha1 -> bytes do logo (uma cópia por logo; a sessão guarda só o hash)
+    """
+    return {"lock": threading.Lock(), "sessoes": {}, "logos": {}}
+
+def tamanho_profundo(obj, _vistos=None):
+    """Estimativa em bytes de um objeto, percorrendo dicts/listas/sets e DataFrames."""
+    if _vistos is None:
+        _vistos = set()
+    if id(obj) in _vistos:
+        return 0
+    _vistos.add(id(obj))
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, io.BytesIO):
+        try:
+            return sys.getsizeof(obj) + obj.getbuffer().nbytes
+        except Exception:
+            return sys.getsizeof(obj)
+    tam = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        tam += sum(tamanho_profundo(k, _vistos) + tamanho_profundo(v, _vistos) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        tam += sum(tamanho_profundo(x, _vistos) for x in obj)
+    return tam
+
+def medir_memoria_sessao(estado, logo_bytes=None):
+    """Tabela (estrutura, itens, bytes) do estado da sessão, da maior para a menor.
+
+    O logo fica fora do session_state (só o hash está nele) e entra como linha própria.
+    """
+    linhas = []
+    for chave in list(estado.keys()):
+        try:
+            valor = estado[chave]
+        except Exception:
+            continue
+        itens = len(valor) if isinstance(valor, (dict, list, tuple, set)) else None
+        linhas.append({"estrutura": str(chave), "itens": itens, "bytes": tamanho_profundo(valor)})
+    if logo_bytes:
+        linhas.append({"estrutura": "logo (1 cópia por hash, compartilhada)", "itens": None, "bytes": len(logo_bytes)})
+    rel = pd.DataFrame(linhas, columns=["estrutura", "itens", "bytes"])
+    return rel.sort_values("bytes", ascending=False).reset_index(drop=True)
+
+def guardar_logo(dados, cache):
+    """Guarda o logo uma única vez por hash; a sessão fica só com o hash em cache["logo_hash"]."""
+    logo_hash = hashlib.sha1(dados).hexdigest()
+    reg = registro_sessoes()
+    with reg["lock"]:
+        reg["logos"].setdefault(logo_hash, dados)
+    cache["logo_hash"] = logo_hash
+
+def obter_logo(cache):
+    logo_hash = cache.get("logo_hash")
+    if not logo_hash:
+        return None
+    reg = registro_sessoes()
+    with reg["lock"]:
+        return reg["logos"].get(logo_hash)
+
+def registrar_acesso_sessao(sessao_id, cache, agora=None):
+    """Marca o acesso da sessão; cache é o dict cache_sessao dela (varrido se ficar ociosa)."""
+    agora = time.time() if agora is None else agora
+    reg = registro_sessoes()
+    with reg["lock"]:
+        reg["sessoes"][sessao_id] = {"ultimo_acesso": agora, "cache": cache}
+
+def varrer_sessoes_ociosas(agora=None, ttl=SESSAO_TTL_SEG):
+    """Descarta os caches das sessões ociosas há mais de ttl; roda no rerun de qualquer sessão.
+
+    Limpa o cache_sessao delas (espelho da grade e hash do logo), marca-o como "expirada"
+    e libera os logos que nenhuma sessão ativa usa. Ajustes manuais, seleção e itens
+    cadastrados são trabalho do representante e ficam; as edições do data_editor são
+    estado de widget e só o Streamlit pode descartá-las. Retorna quantas sessões expirou.
+    """
+    agora = time.time() if agora is None else agora
+    reg = registro_sessoes()
+    sessoes, logos = reg["sessoes"], reg["logos"]
+    with reg["lock"]:
+        ociosas = [sid for sid, info in sessoes.items() if agora - info["ultimo_acesso"] > ttl]
+        for sid in ociosas:
+            cache = sessoes.pop(sid)["cache"]
+            cache.clear()
+            cache["expirada"] = True
+        em_uso = {info["cache"].get("logo_hash") for info in sessoes.values()}
+        for h in [h for h in logos if h not in em_uso]:
+            del logos[h]
+    return len(ociosas)
+
+def registrar_override(overrides, idx, valor, calculado, tol=1e-9):
+    """Guarda o ajuste manual só se difere do valor calculado; igual ao calculado, remove."""
+    if calculado is not None and pd.notnull(calculado) and abs(float(valor) - float(calculado)) <= tol:
+        overrides.pop(idx, None)
+    else:
+        overrides[idx] = float(valor)
+
+def descartar_overrides_iguais(overrides, calculados, tol=1e-9):
+    """Remove ajustes manuais iguais ao valor calculado (calculados: idx -> valor)."""
+    for idx in list(overrides):
+        calc = calculados.get(idx)
+        if calc is not None and pd.notnull(calc) and abs(overrides[idx] - float(calc)) <= tol:
+            del overrides[idx]
+
+def compactar_overrides(overrides, idx_validos):
+    """Remove ajustes manuais de itens que não existem mais no DF atual."""
+    validos = set(idx_validos)
+    for idx in [i for i in overrides if i not in validos]:
+        del overrides[idx]
+
+# ===== Cenários de preço (what-if) =====
+def parse_lista_fatores(texto):
+    """'1,8; 2; 2.2' ou '1.8, 2.0' -> ([1.8, 2.0, 2.2], ignorados).
+
+    Separa por ';' ou espaço; vírgula é decimal, exceto quando o valor já tem '.'
+    (aí ela separa valores). Retorna também os trechos que não viraram fator.
+    """
+    fatores, ignorados = [], []
+    for token in str(texto).replace(";", " ").split():
+        token = token.strip(",")
+        partes = token.split(",") if "." in token else [token.replace(",", ".")]
+        for parte in partes:
+            if not parte:
+                continue
+            try:
+                v = float(parte)
+            except ValueError:
+                ignorados.append(parte)
+                continue
+            if v <= 0:
+                ignorados.append(parte)
+            elif v not in fatores:
+                fatores.append(v)
+    return fatores, ignorados
+
+def matriz_cenarios(df_sel, fatores, tabelas, usa_fator_padrao, manual_preco_venda=None):
+    """Compara cenários (tabela de preço x fator) da seleção numa única operação NumPy.
+
+    usa_fator_padrao (um bool por linha de df_sel, montado em main()) diz quais itens
+    seguem o fator global; só nesses o fator do cenário entra. Os demais (fator da
+    planilha, ajuste manual, cadastro) mantêm df_sel["fator"]. Preço de venda manual
+    fixa o preço do item. Itens sem preço numa tabela ficam fora dela (coluna sem_preco).
+    """
+    colunas = ["tabela", "fator", "itens", "sem_preco", "custo_total", "venda_total",
+               "margem_rs", "margem_pct", "margem_min_pct", "preco_medio"]
+    fatores = np.asarray(fatores, dtype=float)
+    tabelas = [t for t in tabelas if t in df_sel.columns]
+    if df_sel.empty or fatores.size == 0 or not tabelas:
+        return pd.DataFrame(columns=colunas)
+
+    base = np.vstack([pd.to_numeric(df_sel[t], errors="coerce").to_numpy(dtype=float) for t in tabelas])  # (T, N)
+    com_preco = ~np.isnan(base) & (base > 0)                                           # (T, N)
+    base = np.where(com_preco, base, 0.0)
+
+    fat_item = pd.to_numeric(df_sel["fator"], errors="coerce").to_numpy(dtype=float)  # (N,)
+    no_padrao = np.asarray(usa_fator_padrao, dtype=bool) | np.isnan(fat_item) | (fat_item <= 0)
+    pv_man = df_sel["idx"].map(manual_preco_venda or {}).to_numpy(dtype=float)         # (N,) NaN = sem ajuste
+
+    fat = np.where(no_padrao[None, :], fatores[:, None], fat_item[None, :])           # (F, N)
+    venda = base[:, None, :] * fat[None, :, :]                                         # (T, F, N)
+    venda = np.where(np.isnan(pv_man), venda, pv_man)
+    venda = np.where(com_preco[:, None, :], venda, 0.0)
+
+    itens = com_preco.sum(axis=1)                                                      # (T,)
+    custo_total = base.sum(axis=1)[:, None]                                            # (T, 1)
+    venda_total = venda.sum(axis=2)                                                    # (T, F)
+    margem = venda_total - custo_total
+    with np.errstate(divide="ignore", invalid="ignore"):
+        margem_pct = np.where(venda_total > 0, margem / venda_total * 100, np.nan)
+        margem_item = np.where(com_preco[:, None, :] & (venda > 0),
+                               (venda - base[:, None, :]) / venda * 100, np.nan)
+        preco_medio = np.where(itens[:, None] > 0, venda_total / itens[:, None], np.nan)
+    margem_min = np.full(venda_total.shape, np.nan)
+    validos = ~np.isnan(margem_item).all(axis=2)
+    margem_min[validos] = np.nanmin(margem_item[validos], axis=-1)
+
+    n_tab, n_fat = venda_total.shape
+    return pd.DataFrame({
+        "tabela": np.repeat(tabelas, n_fat),
+        "fator": np.tile(fatores, n_tab),
+        "itens": np.repeat(itens, n_fat),
+        "sem_preco": np.repeat(len(df_sel) - itens, n_fat),
+        "custo_total": np.repeat(custo_total[:, 0], n_fat),
+        "venda_total": venda_total.ravel(),
+        "margem_rs": margem.ravel(),
+        "margem_pct": margem_pct.ravel(),
+        "margem_min_pct": margem_min.ravel(),
+        "preco_medio": preco_medio.ravel(),
+    }, columns=colunas)
+
+def exportar_cenarios_excel(df_cen):
+    stream = io.BytesIO()
+    df_cen.to_excel(stream, index=False, sheet_name="Cenários", engine="openpyxl")
+    stream.seek(0)
+    return stream
+
+# ===== Análise das sugestões salvas (matriz esparsa sugestão x vinho) =====
+def ler_indices_sugestao(path):
+    with open(path) as f:
+        return [int(x) for x in f.read().strip().split(",") if x]
+
+@st.cache_resource
+def indice_sugestoes():
+    """Índice das sugestões salvas, compartilhado entre sessões.
+
+    arquivos: nome -> (mtime_ns, tamanho) do arquivo já lido
+    lil: matriz LIL sugestão x vinho, atualizada linha a linha (linha/col mapeiam nome/idx;
+         linhas de sugestões excluídas ficam em livres para reuso)
+    nomes/colunas/matriz: forma CSR compacta para as consultas, convertida uma vez por mudança.
+    """
+    return {"lock": threading.Lock(), "arquivos": {},
+            "lil": sparse.lil_matrix((0, 0), dtype=np.int32),
+            "linha": {}, "nomes_linha": [], "livres": [], "col": {}, "colunas_lista": [],
+            "nomes": [], "colunas": np.empty(0, dtype=np.int64), "matriz": None}
+
+def _assinatura_arquivo(path):
+    st_ = os.stat(path)
+    return (st_.st_mtime_ns, st_.st_size)
+
+def _definir_linha(indice, nome, idxs):
+    """Substitui (ou cria) só a linha da sugestão na matriz LIL."""
+    row = indice["linha"].get(nome)
+    if row is None:
+        if indice["livres"]:
+            row = indice["livres"].pop()
+            indice["nomes_linha"][row] = nome
+        else:
+            row = len(indice["nomes_linha"])
+            indice["nomes_linha"].append(nome)
+        indice["linha"][nome] = row
+    col = indice["col"]
+    for i in idxs:
+        if i not in col:
+            col[i] = len(indice["colunas_lista"])
+            indice["colunas_lista"].append(i)
+    lil = indice["lil"]
+    forma = (len(indice["nomes_linha"]), len(indice["colunas_lista"]))
+    if lil.shape != forma:
+        lil.resize(forma)
+    cols = sorted({col[i] for i in idxs})
+    lil.rows[row] = cols
+    lil.data[row] = [1] * len(cols)
+    indice["matriz"] = None
+
+def _remover_linha(indice, nome):
+    row = indice["linha"].pop(nome, None)
+    if row is None:
+        return
+    indice["lil"].rows[row] = []
+    indice["lil"].data[row] = []
+    indice["nomes_linha"][row] = None
+    indice["livres"].append(row)
+    indice["matriz"] = None
+
+def _compactar_matriz(indice):
+    """Converte a LIL em CSR sem linhas livres nem colunas vazias (uma vez por mudança)."""
+    ativos = [r for r, n in enumerate(indice["nomes_linha"]) if n is not None]
+    csr = indice["lil"].tocsr()[ativos]
+    usadas = np.flatnonzero(csr.getnnz(axis=0))
+    indice["nomes"] = [indice["nomes_linha"][r] for r in ativos]
+    indice["colunas"] = np.asarray(indice["colunas_lista"], dtype=np.int64)[usadas]
+    indice["matriz"] = csr[:, usadas]
+
+def _idxs_unicos(indices):
+    return sorted({int(i) for i in indices})
+
+def registrar_sugestao_no_indice(nome, indices):
+    """Atualiza a linha da sugestão logo após salvar/mesclar (sem reler o arquivo)."""
+    indice = indice_sugestoes()
+    path = os.path.join(SUGESTOES_DIR, f"{nome}.txt")
+    with indice["lock"]:
+        try:
+            assinatura = _assinatura_arquivo(path)
+        except OSError:
+            assinatura = None
+        _definir_linha(indice, nome, _idxs_unicos(indices))
+        # assinatura só depois da linha: se algo falhar, a próxima carga relê o arquivo
+        indice["arquivos"][nome] = assinatura
+
+def atualizar_indice_apos_gravar(nome, indices=None):
+    """Atualiza o índice após salvar/mesclar/excluir; falha aqui não desfaz a gravação."""
+    try:
+        if indices is None:
+            remover_sugestao_do_indice(nome)
+        else:
+            registrar_sugestao_no_indice(nome, indices)
+    except Exception as e:
+        st.warning(f"Arquivo gravado, mas a análise das sugestões não foi atualizada agora ({e}); "
+                   "ela relê a pasta na próxima carga.")
+
+def remover_sugestao_do_indice(nome):
+    indice = indice_sugestoes()
+    with indice["lock"]:
+        indice["arquivos"].pop(nome, None)
+        _remover_linha(indice, nome)
+
+def carregar_matriz_sugestoes():
+    """Sincroniza o índice com SUGESTOES_DIR (só relê arquivos novos/alterados).
+
+    Retorna (nomes, colunas, matriz) onde matriz[i, j] = 1 se a sugestão nomes[i]
+    contém o vinho de idx colunas[j].
+    """
+    indice = indice_sugestoes()
+    with indice["lock"]:
+        arquivos = indice["arquivos"]
+        atuais = {}
+        with os.scandir(SUGESTOES_DIR) as it:
+            for e in it:
+                if e.is_file() and e.name.endswith(".txt"):
+                    st_ = e.stat()
+                    atuais[e.name[:-4]] = (e.path, (st_.st_mtime_ns, st_.st_size))
+        for nome in [n for n in arquivos if n not in atuais]:
+            del arquivos[nome]
+            _remover_linha(indice, nome)
+        for nome, (path, assinatura) in atuais.items():
+            if nome in arquivos and arquivos[nome] == assinatura:
+                continue
+            try:
+                idxs = _idxs_unicos(ler_indices_sugestao(path))
+            except Exception:
+                idxs = []
+            arquivos[nome] = assinatura
+            _definir_linha(indice, nome, idxs)
+        if indice["matriz"] is None:
+            _compactar_matriz(indice)
+        return indice["nomes"], indice["colunas"], indice["matriz"]
+
+def vinhos_mais_frequentes(matriz, colunas, top=20):
+    """Vinhos (idx) presentes no maior número de sugestões."""
+    contagem = np.asarray(matriz.sum(axis=0)).ravel()
+    ordem = np.argsort(-contagem, kind="stable")[:top]
+    ordem = ordem[contagem[ordem] > 0]
+    return pd.DataFrame({"idx": colunas[ordem], "sugestoes": contagem[ordem]})
+
+def sugestoes_com_itens(matriz, nomes, colunas, idxs_alvo):
+    """Sugestões que contêm ao menos um dos idxs_alvo, com a quantidade encontrada."""
+    alvo = np.isin(colunas, np.asarray(list(idxs_alvo), dtype=np.int64)).astype(np.int32)
+    encontrados = matriz @ alvo
+    linhas = np.flatnonzero(encontrados)
+    res = pd.DataFrame({"sugestao": np.asarray(nomes, dtype=object)[linhas], "itens": encontrados[linhas]})
+    return res.sort_values(["itens", "sugestao"], ascending=[False, True]).reset_index(drop=True)
+
+def sobreposicao_sugestoes(matriz, nomes, colunas, nome_a, nome_b):
+    """Itens em comum e exclusivos de duas sugestões, mais o índice de Jaccard."""
+    pos = {n: i for i, n in enumerate(nomes)}
+    linhas = matriz[[pos[nome_a], pos[nome_b]]].toarray().astype(bool)
+    a, b = linhas[0], linhas[1]
+    uniao = int((a | b).sum())
+    return {
+        "comuns": colunas[a & b],
+        "so_a": colunas[a & ~b],
+        "so_b": colunas[b & ~a],
+        "jaccard": (a & b).sum() / uniao if uniao else 0.0,
+    }
+
 # ===================== APP =====================
 def main():
     st.set_page_config(page_title="Sugestão de Carta de Vinhos", layout="wide")
@@ -313,14 +684,27 @@ def main():
     # Estado
     if "selected_idxs" not in st.session_state:
         st.session_state.selected_idxs = set()
-    if "prev_view_state" not in st.session_state:
-        st.session_state.prev_view_state = {}
     if "manual_fat" not in st.session_state:
         st.session_state.manual_fat = {}
     if "manual_preco_venda" not in st.session_state:
         st.session_state.manual_preco_venda = {}
     if "cadastrados" not in st.session_state:
         st.session_state.cadastrados = []
+    if "sessao_id" not in st.session_state:
+        st.session_state.sessao_id = uuid.uuid4().hex
+    # caches descartáveis da sessão (espelho da grade, hash do logo); ver varrer_sessoes_ociosas
+    if "cache_sessao" not in st.session_state:
+        st.session_state.cache_sessao = {}
+    if "logo_upload_n" not in st.session_state:
+        st.session_state.logo_upload_n = 0
+    cache_sessao = st.session_state.cache_sessao
+
+    agora = time.time()
+    sessao_estava_ociosa = bool(cache_sessao.pop("expirada", False))
+    sessao_estava_ociosa |= agora - st.session_state.get("ultimo_acesso", agora) > SESSAO_TTL_SEG
+    st.session_state.ultimo_acesso = agora
+    registrar_acesso_sessao(st.session_state.sessao_id, cache_sessao, agora)
+    varrer_sessoes_ociosas(agora)
 
     st.markdown("### Sugestão de Carta de Vinhos")
 
@@ -329,8 +713,21 @@ def main():
         with c1:
             cliente = st.text_input("Nome do Cliente", value="", placeholder="(opcional)", key="cliente_nome")
         with c2:
-            logo_cliente = st.file_uploader("Carregar logo (cliente)", type=["png","jpg","jpeg"], key="logo_cliente")
-            logo_bytes = logo_cliente.read() if logo_cliente else None
+            logo_cliente = st.file_uploader("Carregar logo (cliente)", type=["png","jpg","jpeg"],
+                                            key=f"logo_cliente_{st.session_state.logo_upload_n}")
+            if logo_cliente is not None:
+                # guarda uma cópia por hash e troca a key do uploader para o Streamlit soltar o upload
+                guardar_logo(logo_cliente.getvalue(), cache_sessao)
+                st.session_state.logo_upload_n += 1
+                st.rerun()
+            logo_bytes = obter_logo(cache_sessao)
+            if logo_bytes:
+                st.caption(f"Logo carregado ({len(logo_bytes)/1024:.0f} KB)")
+                if st.button("Remover logo", key="btn_remover_logo"):
+                    cache_sessao.pop("logo_hash", None)
+                    logo_bytes = None
+            elif sessao_estava_ociosa:
+                st.caption("Sessão ociosa: carregue o logo novamente, se houver.")
         with c3:
             inserir_foto = st.checkbox("Inserir foto no PDF/Excel", value=True, key="chk_foto")
         with c4:
@@ -350,6 +747,8 @@ def main():
 
     # Carrega DF base
     df = ler_excel_vinhos(caminho_planilha)
+    # itens sem fator próprio na planilha (NaN/<=0 vira o fator global)
+    idx_fator_planilha_padrao = set(df.loc[~(df["fator"] > 0), "idx"])
     df = atualiza_coluna_preco_base(df, preco_flag, fator_global=float(fator_global))
 
     # Integra itens cadastrados (sessão)
@@ -361,6 +760,15 @@ def main():
         cad_df["idx"] = pd.to_numeric(cad_df["idx"], errors="coerce").fillna(-1).astype(int)
         df = pd.concat([df, cad_df[df.columns]], ignore_index=True)
 
+    # Sessão ociosa que voltou: descarta ajustes manuais que hoje coincidem com o calculado
+    if sessao_estava_ociosa:
+        descartar_overrides_iguais(st.session_state.manual_fat, dict(zip(df["idx"], df["fator"])))
+        fat_ef = to_float_series(df["idx"].map(st.session_state.manual_fat).combine_first(df["fator"]),
+                                 default=float(fator_global))
+        fat_ef = fat_ef.where(fat_ef > 0, float(fator_global))
+        pv_calc = to_float_series(df["preco_base"], default=0.0) * fat_ef
+        descartar_overrides_iguais(st.session_state.manual_preco_venda, dict(zip(df["idx"], pv_calc)))
+
     # Sidebar de filtros
     st.sidebar.header("Filtros")
     pais_opc = [""] + sorted([p for p in df["pais"].dropna().astype(str).unique().tolist() if p])
@@ -484,7 +892,10 @@ def main():
             sel = bool(row.get("selecionado", False))
             curr_state[idx_i] = sel
 
-    prev_state = st.session_state.get("prev_view_state", {})
+    prev_state = cache_sessao.get("prev_view_state")
+    if prev_state is None:
+        # espelho descartado (sessão ociosa): a grade exibida veio de selected_idxs
+        prev_state = {i: True for i, s in zip(view_df["idx"], view_df["selecionado"]) if s}
     global_sel = set(st.session_state.selected_idxs)
 
     to_add = {i for i, s in curr_state.items() if s and prev_state.get(i) is not True}
@@ -494,9 +905,13 @@ def main():
     global_sel -= to_remove
 
     st.session_state.selected_idxs = global_sel
-    st.session_state.prev_view_state = curr_state
+    # só os marcados importam para detectar desmarcação na próxima execução
+    cache_sessao["prev_view_state"] = {i: True for i, s in curr_state.items() if s}
 
     # Ajustes manuais (aplicados no DF base, por idx) + recomputa preco_de_venda
+    # Guarda apenas o que difere do calculado, para não acumular uma entrada por linha exibida.
+    fat_calc = dict(zip(view_df["idx"], view_df["fator"]))
+    pv_calc = dict(zip(view_df["idx"], view_df["preco_de_venda"]))
     if isinstance(edited, pd.DataFrame) and not edited.empty:
         for _, r in edited.iterrows():
             try:
@@ -504,12 +919,14 @@ def main():
             except Exception:
                 continue
             if pd.notnull(r.get("fator")):
-                st.session_state.manual_fat[idx] = float(r["fator"])
+                registrar_override(st.session_state.manual_fat, idx, r["fator"], fat_calc.get(idx))
             if pd.notnull(r.get("preco_de_venda")):
-                st.session_state.manual_preco_venda[idx] = float(r["preco_de_venda"])
+                registrar_override(st.session_state.manual_preco_venda, idx, r["preco_de_venda"], pv_calc.get(idx))
+    compactar_overrides(st.session_state.manual_fat, df["idx"])
+    compactar_overrides(st.session_state.manual_preco_venda, df["idx"])
 
-    for idx, fat in st.session_state.manual_fat.items():
-        df.loc[df["idx"]==idx, "fator"] = float(fat)
+    if st.session_state.manual_fat:
+        df["fator"] = df["idx"].map(st.session_state.manual_fat).combine_first(df["fator"])
     # caso fator <=0, usa fator_global
     df["fator"] = to_float_series(df["fator"], default=float(fator_global))
     df["fator"] = df["fator"].apply(lambda x: float(fator_global) if pd.isna(x) or x <= 0 else float(x))
@@ -517,8 +934,16 @@ def main():
     df["preco_base"] = to_float_series(df["preco_base"], default=0.0)
     df["preco_de_venda"] = (df["preco_base"].astype(float) * df["fator"].astype(float)).astype(float)
 
-    for idx, pv in st.session_state.manual_preco_venda.items():
-        df.loc[df["idx"]==idx, "preco_de_venda"] = float(pv)
+    if st.session_state.manual_preco_venda:
+        df["preco_de_venda"] = df["idx"].map(st.session_state.manual_preco_venda).combine_first(df["preco_de_venda"])
+
+    # Memória ocupada pela sessão (diagnóstico)
+    # (o expander roda mesmo fechado; a medição fica atrás do checkbox)
+    with st.sidebar.expander("Memória da sessão"):
+        if st.checkbox("Medir memória", value=False, key="chk_memoria"):
+            mem = medir_memoria_sessao(st.session_state, logo_bytes)
+            st.caption(f"Total da sessão: {mem['bytes'].sum()/1024:.1f} KB | Sessões ativas: {len(registro_sessoes()['sessoes'])}")
+            st.dataframe(mem, use_container_width=True, hide_index=True)
 
     # Botões de ação + salvar sugestão
     cA, cB, cC, cD, cE, cF = st.columns([1,1.2,1.2,1.2,1.6,1.2])
@@ -617,9 +1042,7 @@ def main():
             new_set = set(st.session_state.selected_idxs)
             if os.path.exists(path):
                 try:
-                    with open(path) as f:
-                        old = [int(x) for x in f.read().strip().split(",") if x]
-                    new_set |= set(old)
+                    new_set |= set(ler_indices_sugestao(path))
                 except Exception:
                     pass
             try:
@@ -628,10 +1051,58 @@ def main():
                 st.success(f"Sugestão '{nome}' salva (mesclada) em {path}.")
             except Exception as e:
                 st.error(f"Erro ao salvar: {e}")
+            else:
+                atualizar_indice_apos_gravar(nome, new_set)
+
+    # Cenários de preço: compara vários fatores/tabelas para a seleção atual sem rerun por cenário
+    # (o conteúdo de um expander roda mesmo fechado, por isso o cálculo fica atrás do checkbox)
+    with st.expander("Cenários de preço (what-if)"):
+        if st.checkbox("Calcular cenários", value=False, key="chk_cenarios"):
+            tabelas_opc = ["preco1", "preco2", "preco15", "preco38", "preco39", "preco55", "preco63"]
+            cc1, cc2 = st.columns([1, 2])
+            with cc1:
+                fatores_txt = st.text_input("Fatores (separados por ;)", value="1,8; 2,0; 2,2; 2,5", key="cen_fatores")
+            with cc2:
+                tabelas_cen = st.multiselect("Tabelas de preço", tabelas_opc, default=[preco_flag], key="cen_tabelas")
+            fatores_cen, ignorados = parse_lista_fatores(fatores_txt)
+            if ignorados:
+                st.warning(f"Valores ignorados (fator inválido): {', '.join(ignorados)}")
+            if not st.session_state.selected_idxs:
+                st.info("Nenhum item selecionado.")
+            elif not fatores_cen or not tabelas_cen:
+                st.info("Informe ao menos um fator e uma tabela de preço.")
+            else:
+                df_sel = df[df["idx"].isin(st.session_state.selected_idxs)]
+                # na tabela ativa vale o preco_base já calculado (inclui itens cadastrados na sessão)
+                df_sel = df_sel.assign(**{preco_flag: df_sel["preco_base"]})
+                # segue o fator do cenário: sem fator na planilha e sem fator manual válido (> 0)
+                idx_fator_manual = {i for i, v in st.session_state.manual_fat.items() if v > 0}
+                usa_padrao = (df_sel["idx"].isin(idx_fator_planilha_padrao)
+                              & ~df_sel["idx"].isin(idx_fator_manual)).to_numpy()
+                df_cen = matriz_cenarios(df_sel, fatores_cen, tabelas_cen, usa_padrao,
+                                         st.session_state.manual_preco_venda)
+                st.dataframe(
+                    df_cen, use_container_width=True, hide_index=True,
+                    column_config={
+                        "sem_preco": st.column_config.NumberColumn("SEM PRECO", help="Itens sem preço nesta tabela (fora dos totais)"),
+                        "custo_total": st.column_config.NumberColumn("CUSTO", format="R$ %.2f"),
+                        "venda_total": st.column_config.NumberColumn("VENDA", format="R$ %.2f"),
+                        "margem_rs": st.column_config.NumberColumn("MARGEM", format="R$ %.2f"),
+                        "margem_pct": st.column_config.NumberColumn("MARGEM %", format="%.1f%%"),
+                        "margem_min_pct": st.column_config.NumberColumn("MENOR MARGEM ITEM %", format="%.1f%%"),
+                        "preco_medio": st.column_config.NumberColumn("PRECO MEDIO", format="R$ %.2f"),
+                    },
+                )
+                # planilha só é montada quando pedida
+                if st.button("Exportar cenários (Excel)", key="btn_cenarios_excel"):
+                    st.download_button("Baixar cenários", data=exportar_cenarios_excel(df_cen),
+                                       file_name="cenarios_preco.xlsx",
+                                       mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                       key="dl_cenarios")
 
     # Abas
     st.markdown("---")
-    tab1, tab2 = st.tabs(["Sugestões Salvas", "Cadastro de Vinhos"])
+    tab1, tab2, tab3 = st.tabs(["Sugestões Salvas", "Cadastro de Vinhos", "Análise das Sugestões"])
 
     with tab1:
         garantir_pastas()
@@ -644,8 +1115,7 @@ def main():
             path = os.path.join(SUGESTOES_DIR, f"{sel}.txt")
             if os.path.exists(path):
                 try:
-                    with open(path) as f:
-                        sugestao_indices = [int(x) for x in f.read().strip().split(",") if x]
+                    sugestao_indices = ler_indices_sugestao(path)
                     # Carrega a sugestão (substitui seleção atual)
                     st.session_state.selected_idxs = set(sugestao_indices)
                     st.info(f"Sugestão '{sel}' carregada: {len(sugestao_indices)} itens.")
@@ -668,6 +1138,7 @@ def main():
                 if sel:
                     try:
                         os.remove(os.path.join(SUGESTOES_DIR, f"{sel}.txt"))
+                        atualizar_indice_apos_gravar(sel)
                         st.success(f"Sugestão '{sel}' excluída.")
                         st.experimental_rerun()
                     except Exception as e:
@@ -679,16 +1150,15 @@ def main():
                 if sel:
                     path = os.path.join(SUGESTOES_DIR, f"{sel}.txt")
                     try:
-                        old = []
-                        if os.path.exists(path):
-                            with open(path) as f:
-                                old = [int(x) for x in f.read().strip().split(",") if x]
+                        old = ler_indices_sugestao(path) if os.path.exists(path) else []
                         new_set = set(old) | set(st.session_state.selected_idxs)
                         with open(path, "w") as f:
                             f.write(",".join(map(str, sorted(list(new_set)))))
                         st.success(f"Sugestão '{sel}' atualizada (itens mesclados).")
                     except Exception as e:
                         st.error(f"Erro ao salvar: {e}")
+                    else:
+                        atualizar_indice_apos_gravar(sel, new_set)
                 else:
                     st.info("Selecione uma sugestão na lista.")
         with colz:
@@ -742,5 +1212,54 @@ def main():
             except Exception as e:
                 st.error(f"Erro ao cadastrar: {e}")
 
+    with tab3:
+        st.caption("Análise de todas as sugestões salvas (matriz sugestão x vinho, atualizada a cada salvamento).")
+        if st.checkbox("Carregar análise", value=False, key="chk_analise"):
+            garantir_pastas()
+            nomes, colunas, matriz = carregar_matriz_sugestoes()
+            if not nomes:
+                st.info("Nenhuma sugestão salva.")
+            else:
+                cat = df.drop_duplicates("idx").set_index("idx")
+                def rotulo(i):
+                    return f"{i} - {cat.at[i, 'descricao']}" if i in cat.index else f"{i} - (fora do catálogo)"
+                def com_catalogo(res):
+                    return res.join(cat[["cod", "descricao", "pais"]], on="idx")
+
+                st.caption(f"Sugestões: {len(nomes)} | Vinhos distintos: {len(colunas)} | Inclusões: {matriz.nnz}")
+
+                st.subheader("Vinhos presentes em mais cartas")
+                top_n = st.number_input("Quantidade", min_value=5, max_value=200, value=20, step=5, key="an_top")
+                st.dataframe(com_catalogo(vinhos_mais_frequentes(matriz, colunas, int(top_n))),
+                             use_container_width=True, hide_index=True)
+
+                st.subheader("Cartas com itens fora do catálogo atual")
+                fora = colunas[~np.isin(colunas, df["idx"].to_numpy())]
+                if fora.size:
+                    st.dataframe(sugestoes_com_itens(matriz, nomes, colunas, fora), use_container_width=True, hide_index=True)
+                else:
+                    st.caption("Todas as sugestões usam apenas itens do catálogo atual.")
+
+                st.subheader("Cartas que contêm vinhos específicos")
+                alvo = st.multiselect("Vinhos", colunas.tolist(), format_func=rotulo, key="an_itens")
+                if alvo:
+                    st.dataframe(sugestoes_com_itens(matriz, nomes, colunas, alvo), use_container_width=True, hide_index=True)
+
+                st.subheader("Sobreposição entre duas cartas")
+                ca, cb = st.columns(2)
+                with ca:
+                    sug_a = st.selectbox("Sugestão A", [""] + sorted(nomes), key="an_sug_a")
+                with cb:
+                    sug_b = st.selectbox("Sugestão B", [""] + sorted(nomes), key="an_sug_b")
+                if sug_a and sug_b:
+                    sob = sobreposicao_sugestoes(matriz, nomes, colunas, sug_a, sug_b)
+                    st.caption(f"Em comum: {len(sob['comuns'])} | Só em A: {len(sob['so_a'])} | "
+                               f"Só em B: {len(sob['so_b'])} | Jaccard: {sob['jaccard']:.2f}")
+                    for titulo, chave in (("Em comum", "comuns"), ("Só em A", "so_a"), ("Só em B", "so_b")):
+                        if len(sob[chave]):
+                            st.markdown(f"**{titulo}**")
+                            st.dataframe(com_catalogo(pd.DataFrame({"idx": sob[chave]})),
+                                         use_container_width=True, hide_index=True)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+teste_carga.py
+
+Teste de carga do app (main) sem navegador, via streamlit.testing (AppTest).
+
+- Gera um catálogo sintético (.xlsx) com N vinhos.
+- Simula N sessões simultâneas de representantes, cada uma repetindo o fluxo:
+  buscar, filtrar, marcar/desmarcar itens, mudar o fator, salvar sugestão e gerar PDF.
+- Cada sessão roda no seu próprio processo: o AppTest troca estado global do
+  Streamlit (Runtime, secrets, config) a cada run, então threads não servem.
+- Para cada nível de concorrência informa p50/p95 da latência de rerun,
+  throughput (reruns/s) e o RSS amostrado durante o fluxo. Esse RSS é por
+  processo, com caches isolados (st.cache_resource não é compartilhado), medido a
+  partir de um processo já aquecido (app importado e executado uma vez).
+- Para dimensionar o servidor (1 processo, N sessões) há uma passada à parte num
+  único processo, com as sessões intercaladas (round-robin) e caches compartilhados:
+  informa o RSS base, o pico e o acréscimo por sessão.
+
+Uso:
+    python teste_carga.py --vinhos 300 --concorrencia 1,2,4,8 --iteracoes 3
+    python teste_carga.py --max-p95-ms 1500   # sai com código 1 se algum nível estourar
+"""
+
+import os
+import sys
+import glob
+import time
+import gc
+import queue
+import argparse
+import tempfile
+import threading
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PADRAO = os.path.join(BASE_DIR, "app_streamlit (2).py")
+PREFIXO_SUGESTAO = "__carga_"
+
+PAISES = ["Argentina", "Chile", "Brasil", "Portugal", "Itália", "França", "Espanha", "Uruguai"]
+TIPOS = ["Espumante", "Branco", "Rosé", "Tinto", "Fortificado"]
+UVAS = ["Malbec", "Cabernet Sauvignon", "Merlot", "Chardonnay", "Sauvignon Blanc", "Touriga Nacional", "Tannat", "Pinot Noir"]
+TABELAS = ["preco38", "preco39", "preco1", "preco2", "preco15", "preco55", "preco63"]
+
+# ===== Catálogo sintético =====
+def gerar_catalogo_sintetico(n_vinhos, caminho, seed=0):
+    rng = np.random.default_rng(seed)
+    pais = rng.choice(PAISES, n_vinhos)
+    base = rng.uniform(30, 600, n_vinhos).round(2)
+    df = pd.DataFrame({
+        "idx": np.arange(n_vinhos),
+        "cod": 1000 + np.arange(n_vinhos),
+        "descricao": [f"Vinho Sintético {i:04d}" for i in range(n_vinhos)],
+        "pais": pais,
+        "regiao": [f"Região {p[:3]} {r}" for p, r in zip(pais, rng.integers(1, 6, n_vinhos))],
+        "tipo": rng.choice(TIPOS, n_vinhos),
+        "uva1": rng.choice(UVAS, n_vinhos),
+        "uva2": "",
+        "uva3": "",
+        "amadurecimento": rng.choice(["", "12 meses em carvalho"], n_vinhos),
+        "vinicola": [f"Vinícola {i % 40}" for i in range(n_vinhos)],
+        "fator": 0.0,
+    })
+    for i, col in enumerate(TABELAS):
+        df[col] = (base * (1 + 0.03 * i)).round(2)
+    df.to_excel(caminho, index=False, engine="openpyxl")
+    return df
+
+# ===== Medições =====
+def rss_atual_mb():
+    """RSS atual do processo (Linux: /proc); em outros sistemas, o pico via resource."""
+    try:
+        with open("/proc/self/status") as f:
+            for linha in f:
+                if linha.startswith("VmRSS:"):
+                    return int(linha.split()[1]) / 1024
+    except Exception:
+        pass
+    try:
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+    except Exception:
+        return float("nan")
+
+def _amostrar_rss(parar, pico, intervalo=0.05):
+    while not parar.wait(intervalo):
+        pico[0] = max(pico[0], rss_atual_mb())
+
+# ===== Fluxo de um representante =====
+def criar_sessao(app_path, catalogo, timeout):
+    at = AppTest.from_file(app_path, default_timeout=timeout)
+    at.session_state["caminho_planilha"] = catalogo["caminho"]
+    return at
+
+def aquecer(app_path, catalogo, timeout):
+    """Importa e executa o app uma vez, para o RSS base não incluir a partida."""
+    at = criar_sessao(app_path, catalogo, timeout)
+    at.run()
+    del at
+    gc.collect()
+
+def etapas_representante(at, catalogo, sessao, iteracoes, seed):
+    """Gera (etapa, ação) do fluxo de um representante; cada ação é seguida de um rerun."""
+    rng = np.random.default_rng(seed)
+
+    def definir_selecao(idxs_sel):
+        at.session_state["selected_idxs"] = set(idxs_sel)
+
+    yield "abrir", None
+    idxs = catalogo["idxs"]
+    for it in range(iteracoes):
+        termo = f"{int(rng.integers(0, len(idxs))):04d}"
+        yield "buscar", lambda: at.text_input(key="termo_global").input(termo)
+        yield "limpar_busca", lambda: at.text_input(key="termo_global").input("")
+        pais = str(rng.choice(catalogo["paises"]))
+        yield "filtrar", lambda: at.selectbox(key="filt_pais").select(pais)
+        yield "limpar_filtro", lambda: at.selectbox(key="filt_pais").select("")
+
+        # data_editor não é interativo no AppTest: a seleção é feita pelo estado da sessão
+        marcados = set(int(i) for i in rng.choice(idxs, size=min(30, len(idxs)), replace=False))
+        yield "marcar", lambda: definir_selecao(marcados)
+        desmarcar = set(list(marcados)[: len(marcados) // 3])
+        yield "desmarcar", lambda: definir_selecao(marcados - desmarcar)
+
+        fator = round(float(rng.uniform(1.5, 3.0)), 1)
+        yield "fator", lambda: at.number_input(key="fator_global_input").set_value(fator)
+
+        nome = f"{PREFIXO_SUGESTAO}{sessao}_{it}"
+        yield "nome_sugestao", lambda: at.text_input(key="nome_sugestao_input").input(nome)
+        yield "salvar_sugestao", lambda: at.button(key="btn_salvar").click()
+        yield "gerar_pdf", lambda: at.button(key="btn_pdf").click()
+
+def executar_etapa(at, etapa, acao, latencias, erros):
+    t0 = time.perf_counter()
+    try:
+        if acao is not None:
+            acao()
+        at.run()
+    except Exception as e:
+        erros.append(f"{etapa}: {e}")
+        return
+    latencias.append((etapa, time.perf_counter() - t0))
+    if at.exception:
+        erros.append(f"{etapa}: {at.exception[0].value}")
+
+def fluxo_representante(app_path, catalogo, sessao, iteracoes, timeout, seed):
+    """Executa o fluxo numa sessão. Retorna (latências em s por etapa, erros)."""
+    latencias, erros = [], []
+    at = criar_sessao(app_path, catalogo, timeout)
+    for etapa, acao in etapas_representante(at, catalogo, sessao, iteracoes, seed):
+        executar_etapa(at, etapa, acao, latencias, erros)
+    return latencias, erros
+
+def _iniciar_amostrador():
+    pico = [rss_atual_mb()]
+    parar = threading.Event()
+    amostrador = threading.Thread(target=_amostrar_rss, args=(parar, pico), daemon=True)
+    amostrador.start()
+    return pico, parar, amostrador
+
+def _processo_sessao(app_path, catalogo, sessao, iteracoes, timeout, seed, barreira, fila):
+    """Uma sessão simulada num processo próprio; devolve o resultado pela fila."""
+    res = {"sessao": sessao, "latencias": [], "erros": [], "inicio": None, "fim": None,
+           "rss_base_mb": float("nan"), "rss_pico_mb": float("nan")}
+    pico, parar, amostrador = None, None, None
+    try:
+        aquecer(app_path, catalogo, timeout)
+        res["rss_base_mb"] = rss_atual_mb()
+        pico, parar, amostrador = _iniciar_amostrador()
+        # todas as sessões começam juntas, já aquecidas
+        barreira.wait(timeout=300)
+        res["inicio"] = time.time()
+        res["latencias"], res["erros"] = fluxo_representante(app_path, catalogo, sessao, iteracoes, timeout, seed)
+    except Exception as e:
+        res["erros"].append(f"sessão {sessao}: {e}")
+    finally:
+        res["fim"] = time.time()
+        if amostrador is not None:
+            parar.set()
+            amostrador.join()
+            res["rss_pico_mb"] = max(pico[0], rss_atual_mb())
+        fila.put(res)
+
+def _processo_unico(app_path, catalogo, n_sessoes, iteracoes, timeout, fila):
+    """N sessões num só processo, intercaladas etapa a etapa (como num servidor)."""
+    res = {"sessoes": n_sessoes, "latencias": [], "erros": [],
+           "rss_base_mb": float("nan"), "rss_pico_mb": float("nan"), "rss_final_mb": float("nan")}
+    pico, parar, amostrador = None, None, None
+    try:
+        aquecer(app_path, catalogo, timeout)
+        res["rss_base_mb"] = rss_atual_mb()
+        pico, parar, amostrador = _iniciar_amostrador()
+        sessoes = []
+        for sessao in range(n_sessoes):
+            at = criar_sessao(app_path, catalogo, timeout)
+            # sessões do passe único usam faixa própria de nomes de sugestão
+            sessoes.append((at, etapas_representante(at, catalogo, f"rr{sessao}", iteracoes, seed=50000 + sessao)))
+        while sessoes:
+            ativas = []
+            for at, etapas in sessoes:
+                try:
+                    etapa, acao = next(etapas)
+                except StopIteration:
+                    continue
+                executar_etapa(at, etapa, acao, res["latencias"], res["erros"])
+                ativas.append((at, etapas))
+            sessoes = ativas
+        # todas as sessões ainda existem aqui (AppTest guarda o session_state de cada uma)
+        res["rss_final_mb"] = rss_atual_mb()
+    except Exception as e:
+        res["erros"].append(f"processo único: {e}")
+    finally:
+        if amostrador is not None:
+            parar.set()
+            amostrador.join()
+            res["rss_pico_mb"] = max(pico[0], rss_atual_mb())
+        fila.put(res)
+
+def rodar_nivel(app_path, catalogo, concorrencia, iteracoes, timeout):
+    ctx = mp.get_context("spawn")
+    barreira = ctx.Barrier(concorrencia)
+    fila = ctx.Queue()
+    procs = [
+        ctx.Process(target=_processo_sessao,
+                    args=(app_path, catalogo, sessao, iteracoes, timeout, 1000 * concorrencia + sessao, barreira, fila))
+        for sessao in range(concorrencia)
+    ]
+    for p in procs:
+        p.start()
+
+    # pior caso: todos os reruns da sessão estourando o timeout, mais a partida do processo
+    espera = timeout * (1 + 10 * iteracoes) + 180
+    resultados, erros = [], []
+    for _ in procs:
+        try:
+            resultados.append(fila.get(timeout=espera))
+        except queue.Empty:
+            erros.append("sessão sem resposta (processo travou ou morreu)")
+            break
+    for p in procs:
+        p.join(timeout=10)
+        if p.is_alive():
+            p.terminate()
+
+    latencias = [l for r in resultados for l in r["latencias"]]
+    erros += [e for r in resultados for e in r["erros"]]
+    inicios = [r["inicio"] for r in resultados if r["inicio"] is not None]
+    duracao = max(r["fim"] for r in resultados) - min(inicios) if inicios else 0.0
+
+    tempos_ms = np.array([t for _, t in latencias]) * 1000
+    picos = np.array([r["rss_pico_mb"] for r in resultados], dtype=float)
+    acrescimos = np.array([r["rss_pico_mb"] - r["rss_base_mb"] for r in resultados], dtype=float)
+    return {
+        "concorrencia": concorrencia,
+        "reruns": len(tempos_ms),
+        "erros": len(erros),
+        "p50_ms": float(np.percentile(tempos_ms, 50)) if len(tempos_ms) else float("nan"),
+        "p95_ms": float(np.percentile(tempos_ms, 95)) if len(tempos_ms) else float("nan"),
+        "reruns_por_s": len(tempos_ms) / duracao if duracao > 0 else float("nan"),
+        "rss_pico_processo_mb": float(picos.max()) if picos.size else float("nan"),
+        "rss_sessao_isolada_mb": float(acrescimos.mean()) if acrescimos.size else float("nan"),
+    }, latencias, erros
+
+def rodar_processo_unico(app_path, catalogo, n_sessoes, iteracoes, timeout):
+    """Roda _processo_unico num processo novo (estado do Streamlit limpo) e devolve o resumo."""
+    ctx = mp.get_context("spawn")
+    fila = ctx.Queue()
+    proc = ctx.Process(target=_processo_unico, args=(app_path, catalogo, n_sessoes, iteracoes, timeout, fila))
+    proc.start()
+    espera = timeout * n_sessoes * (1 + 10 * iteracoes) + 180
+    try:
+        res = fila.get(timeout=espera)
+    except queue.Empty:
+        res = {"sessoes": n_sessoes, "latencias": [], "erros": ["processo único sem resposta"],
+               "rss_base_mb": float("nan"), "rss_pico_mb": float("nan"), "rss_final_mb": float("nan")}
+    proc.join(timeout=10)
+    if proc.is_alive():
+        proc.terminate()
+    tempos_ms = np.array([t for _, t in res["latencias"]]) * 1000
+    return {
+        "sessoes": n_sessoes,
+        "reruns": len(tempos_ms),
+        "erros": len(res["erros"]),
+        "p50_ms": float(np.percentile(tempos_ms, 50)) if len(tempos_ms) else float("nan"),
+        "p95_ms": float(np.percentile(tempos_ms, 95)) if len(tempos_ms) else float("nan"),
+        "rss_base_mb": res["rss_base_mb"],
+        "rss_pico_mb": res["rss_pico_mb"],
+        "rss_por_sessao_mb": (res["rss_final_mb"] - res["rss_base_mb"]) / n_sessoes if n_sessoes else float("nan"),
+    }, res["erros"]
+
+def limpar_sugestoes_de_teste(app_path):
+    for f in glob.glob(os.path.join(os.path.dirname(app_path), "sugestoes", f"{PREFIXO_SUGESTAO}*.txt")):
+        try:
+            os.remove(f)
+        except Exception:
+            pass
+
+# ===================== CLI =====================
+def main():
+    ap = argparse.ArgumentParser(description="Teste de carga do app de carta de vinhos (AppTest).")
+    ap.add_argument("--app", default=APP_PADRAO, help="Script do app Streamlit")
+    ap.add_argument("--vinhos", type=int, default=300, help="Tamanho do catálogo sintético")
+    ap.add_argument("--concorrencia", default="1,2,4,8", help="Níveis de sessões simultâneas (ex.: 1,2,4,8)")
+    ap.add_argument("--iteracoes", type=int, default=3, help="Repetições do fluxo por sessão")
+    ap.add_argument("--timeout", type=float, default=60.0, help="Timeout de cada rerun (s)")
+    ap.add_argument("--saida", default="", help="CSV opcional com o resumo por nível")
+    ap.add_argument("--sessoes-memoria", type=int, default=-1,
+                    help="Sessões no passe de 1 processo (round-robin); padrão = maior nível; 0 = não roda")
+    ap.add_argument("--max-p95-ms", type=float, default=0.0, help="Falha (código 1) se p95 passar disso; 0 = não verifica")
+    args = ap.parse_args()
+
+    app_path = os.path.abspath(args.app)
+    niveis = [int(x) for x in args.concorrencia.split(",") if x.strip()]
+    if not niveis:
+        ap.error("informe ao menos um nível de concorrência")
+    sessoes_memoria = max(niveis) if args.sessoes_memoria < 0 else args.sessoes_memoria
+
+    with tempfile.TemporaryDirectory() as tmp:
+        caminho = os.path.join(tmp, "catalogo_sintetico.xlsx")
+        df = gerar_catalogo_sintetico(args.vinhos, caminho)
+        catalogo = {"caminho": caminho, "idxs": df["idx"].to_numpy(), "paises": sorted(df["pais"].unique())}
+        print(f"Catálogo sintético: {args.vinhos} vinhos | RSS inicial: {rss_atual_mb():.1f} MB")
+
+        resumo, unico = [], None
+        try:
+            for n in niveis:
+                linha, latencias, erros = rodar_nivel(app_path, catalogo, n, args.iteracoes, args.timeout)
+                resumo.append(linha)
+                print(f"[{n:>3} sessões] reruns={linha['reruns']} erros={linha['erros']} "
+                      f"p50={linha['p50_ms']:.0f}ms p95={linha['p95_ms']:.0f}ms "
+                      f"{linha['reruns_por_s']:.1f} reruns/s | RSS por processo (caches isolados): "
+                      f"pico={linha['rss_pico_processo_mb']:.1f}MB, +{linha['rss_sessao_isolada_mb']:.1f}MB sobre o aquecido")
+                if erros:
+                    for e in erros[:5]:
+                        print(f"    erro: {e}")
+                if latencias:
+                    por_etapa = pd.DataFrame(latencias, columns=["etapa", "s"]).groupby("etapa")["s"]
+                    print("    p95 por etapa (ms): " + ", ".join(
+                        f"{k}={v*1000:.0f}" for k, v in por_etapa.quantile(0.95).sort_values(ascending=False).items()))
+            if sessoes_memoria > 0:
+                unico, erros_unico = rodar_processo_unico(app_path, catalogo, sessoes_memoria, args.iteracoes, args.timeout)
+                print(f"[1 processo, {sessoes_memoria} sessões round-robin] reruns={unico['reruns']} "
+                      f"erros={unico['erros']} p50={unico['p50_ms']:.0f}ms p95={unico['p95_ms']:.0f}ms | "
+                      f"RSS base={unico['rss_base_mb']:.1f}MB pico={unico['rss_pico_mb']:.1f}MB "
+                      f"+{unico['rss_por_sessao_mb']:.2f}MB/sessão")
+                for e in erros_unico[:5]:
+                    print(f"    erro: {e}")
+        finally:
+            limpar_sugestoes_de_teste(app_path)
+
+    tabela = pd.DataFrame(resumo)
+    print()
+    print(tabela.to_string(index=False, float_format=lambda v: f"{v:.1f}"))
+    if unico is not None:
+        print()
+        print("Dimensionamento (1 processo, caches compartilhados):")
+        print(pd.DataFrame([unico]).to_string(index=False, float_format=lambda v: f"{v:.2f}"))
+    if args.saida:
+        tabela.to_csv(args.saida, index=False)
+        print(f"Resumo salvo em {args.saida}")
+
+    if args.max_p95_ms and (tabela["p95_ms"] > args.max_p95_ms).any():
+        print(f"FALHA: p95 acima de {args.max_p95_ms:.0f} ms.")
+        return 1
+    if tabela["erros"].sum() or (unico is not None and unico["erros"]):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())